@@ -1,24 +1,48 @@
 import os
-import json
+import atexit
 import logging
 import asyncio
-from typing import Dict, Optional
+import queue
+import hashlib
+import random
+import time
+from collections import deque
+from contextlib import asynccontextmanager
+from logging.handlers import QueueHandler, QueueListener
+from typing import Deque, Dict, List, Optional, Tuple
 
 from aiogram import Bot, Dispatcher, F, types
 from aiogram.enums import ParseMode
 from aiogram.filters import Command
-from aiogram.types import Message, ReplyKeyboardMarkup, KeyboardButton, BufferedInputFile
+from aiogram.types import Message, ReplyKeyboardMarkup, KeyboardButton, URLInputFile
 from aiogram.client.default import DefaultBotProperties
+from aiogram.client.session.aiohttp import AiohttpSession
+from aiogram.utils.chat_action import ChatActionSender
 from aiogram.utils.keyboard import ReplyKeyboardBuilder
 from aiogram.webhook.aiohttp_server import SimpleRequestHandler, setup_application
-from aiohttp import web, ClientSession
+from aiohttp import (
+    web, ClientSession, ClientTimeout, TCPConnector, DummyCookieJar,
+    ClientConnectorError, ServerDisconnectedError
+)
+from cachetools import LRUCache, TTLCache
 from dotenv import load_dotenv
+import orjson
 
-# Настройка логов
+# Настройка логов: запись в stderr идёт в отдельном потоке, не блокируя цикл событий
+log_queue: queue.SimpleQueue = queue.SimpleQueue()
+log_handler = logging.StreamHandler()
+log_handler.setFormatter(
+    logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+)
+log_listener = QueueListener(log_queue, log_handler)
 logging.basicConfig(
     level=logging.INFO,
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+    format='%(message)s',  # полный формат применяет log_handler
+    handlers=[QueueHandler(log_queue)],
+    force=True
 )
+log_listener.start()
+atexit.register(log_listener.stop)
 logger = logging.getLogger(__name__)
 
 # Загрузка конфигурации
@@ -26,39 +50,211 @@ load_dotenv()
 TOKEN = os.getenv("TELEGRAM_BOT_TOKEN")
 OPENROUTER_API_KEY = os.getenv("OPENROUTER_API_KEY")
 BASE_URL = os.getenv("BASE_URL")
-PORT = int(os.getenv("PORT"))
+PORT = int(os.getenv("PORT", "10000"))
 SITE_URL = os.getenv("SITE_URL", "https://your-telegram-bot.com")
 SITE_NAME = os.getenv("SITE_NAME", "AI Telegram Bot")
 
 # Проверка обязательных переменных
-if not TOKEN or not OPENROUTER_API_KEY:
+if not TOKEN or not OPENROUTER_API_KEY or not BASE_URL:
     raise ValueError("Не заданы обязательные переменные окружения")
 
-# Инициализация бота
-bot = Bot(token=TOKEN, default=DefaultBotProperties(parse_mode=ParseMode.HTML))
+OPENROUTER_CHAT_URL = "https://openrouter.ai/api/v1/chat/completions"
+OPENROUTER_IMAGES_URL = "https://openrouter.ai/api/v1/images/generations"
+# Неизменный префикс диалога: одинаковые байты в каждом запросе
+# позволяют провайдеру переиспользовать кэш префикса
+SYSTEM_PROMPT = [{
+    "role": "system",
+    "content": "Ты — полезный AI-ассистент в Telegram. Отвечай на языке пользователя."
+}]
+OPENROUTER_HEADERS = {
+    "Authorization": f"Bearer {OPENROUTER_API_KEY}",
+    "HTTP-Referer": SITE_URL,
+    "X-Title": SITE_NAME
+}
+
+def dumps_json(obj) -> str:
+    return orjson.dumps(obj).decode()
+
+# Инициализация бота: orjson для запросов к Bot API и разбора вебхуков
+bot = Bot(
+    token=TOKEN,
+    session=AiohttpSession(json_loads=orjson.loads, json_dumps=dumps_json),
+    default=DefaultBotProperties(parse_mode=ParseMode.HTML)
+)
 dp = Dispatcher()
 
 # Хранение данных
-user_context: Dict[int, Dict] = {}
+# Контекст неактивных пользователей удаляется через час, всего не более 10 000
+MAX_USERS = 10_000
+user_context: TTLCache = TTLCache(maxsize=MAX_USERS, ttl=3600)
 http_session: Optional[ClientSession] = None
+# file_id уже отправленных картинок по хэшу промпта и генерации "в полёте"
+image_cache: LRUCache = LRUCache(maxsize=1024)
+image_inflight: Dict[str, asyncio.Future] = {}
+# update_id за последнюю минуту: Telegram повторяет доставку вебхука при сбоях
+seen_updates: TTLCache = TTLCache(maxsize=100_000, ttl=60)
+# Время последнего апдейта от Telegram, чтобы не пинговать активный сервис
+last_activity = time.monotonic()
+KEEP_ALIVE_INTERVAL = 300
+# Ответы модели на первое сообщение диалога. Ответ сэмплирован с temperature > 0,
+# поэтому кэш только для открывающих реплик и с коротким TTL
+reply_cache: TTLCache = TTLCache(maxsize=5000, ttl=300)
+reply_inflight: Dict[str, asyncio.Future] = {}
+# Сообщения, присланные подряд за CHAT_DEBOUNCE секунд, уходят одним запросом
+CHAT_DEBOUNCE = 0.3
+# Ключ — (chat_id, user_id): ответ уходит в тот чат, откуда пришли сообщения
+pending_messages: Dict[Tuple[int, int], List[str]] = {}
 
-def get_main_kb() -> ReplyKeyboardMarkup:
-    builder = ReplyKeyboardBuilder()
-    builder.row(
-        KeyboardButton(text="🖼 Сгенерировать изображение"),
-        KeyboardButton(text="🔄 Сбросить контекст")
-    )
-    return builder.as_markup(resize_keyboard=True)
-
-async def generate_image(prompt: str) -> Optional[bytes]:
-    """Генерация изображения через Stable Diffusion XL"""
-    headers = {
-        "Authorization": f"Bearer {OPENROUTER_API_KEY}",
-        "Content-Type": "application/json",
-        "HTTP-Referer": SITE_URL,
-        "X-Title": SITE_NAME
-    }
-    
+# Пауза, если X-RateLimit-Remaining-Requests обнулился без Retry-After
+RATE_LIMIT_PAUSE = 1.0
+
+class Admission:
+    """Адаптивный лимит параллельных запросов к OpenRouter (AIMD)
+
+    Успешный быстрый ответ увеличивает лимит на 0.5, а 429/5xx, ошибка
+    соединения или ответ дольше target_latency уменьшают его вдвое.
+    Заголовок Retry-After или обнулившийся X-RateLimit-Remaining-Requests
+    приостанавливают все новые запросы.
+    """
+
+    def __init__(self, initial: float = 4, minimum: float = 1,
+                 maximum: float = 32, target_latency: float = 30.0):
+        self.limit = initial
+        self.minimum = minimum
+        self.maximum = maximum
+        self.target_latency = target_latency
+        self._active = 0
+        self._paused_until = 0.0
+        self._waiters: List[asyncio.Future] = []
+
+    async def _acquire(self):
+        while self._active >= int(self.limit):
+            waiter = asyncio.get_running_loop().create_future()
+            self._waiters.append(waiter)
+            try:
+                await waiter
+            except asyncio.CancelledError:
+                self._waiters.remove(waiter)
+                # Отменённую задачу уже могли разбудить — отдаём место следующей
+                if not waiter.cancelled():
+                    self._wake()
+                raise
+            self._waiters.remove(waiter)
+        self._active += 1
+
+        delay = self._paused_until - time.monotonic()
+        if delay > 0:
+            try:
+                await asyncio.sleep(delay)
+            except asyncio.CancelledError:
+                self._active -= 1
+                self._wake()
+                raise
+
+    def _wake(self):
+        free = int(self.limit) - self._active
+        for waiter in self._waiters[:max(free, 0)]:
+            if not waiter.done():
+                waiter.set_result(None)
+
+    def _release(self, overloaded: bool):
+        self._active -= 1
+        if overloaded:
+            self.limit = max(self.minimum, self.limit * 0.5)
+        else:
+            self.limit = min(self.maximum, self.limit + 0.5)
+        self._wake()
+
+    @asynccontextmanager
+    async def request(self, method: str, url: str, **kwargs):
+        await self._acquire()
+        started = time.monotonic()
+        overloaded = True
+        try:
+            async with http_session.request(method, url, **kwargs) as response:
+                exhausted = response.headers.get("X-RateLimit-Remaining-Requests") == "0"
+                overloaded = exhausted or response.status == 429 or response.status >= 500
+                retry_after = response.headers.get("Retry-After", "")
+                if retry_after.isdigit():
+                    self._paused_until = time.monotonic() + int(retry_after)
+                elif exhausted:
+                    # Квота исчерпана, но срок не указан — короткая пауза
+                    self._paused_until = time.monotonic() + RATE_LIMIT_PAUSE
+                yield response
+        finally:
+            if time.monotonic() - started > self.target_latency:
+                overloaded = True
+            self._release(overloaded)
+
+# У чата и генерации картинок разное нормальное время ответа, поэтому лимиты раздельные
+openrouter = {
+    OPENROUTER_CHAT_URL: Admission(target_latency=30.0),
+    OPENROUTER_IMAGES_URL: Admission(target_latency=50.0),
+}
+
+# Временные ошибки OpenRouter, после которых запрос стоит повторить
+RETRY_STATUSES = {429, 502, 503, 504}
+
+async def post_openrouter(url: str, payload: dict, tries: int = 3) -> Tuple[int, bytes]:
+    """POST в OpenRouter с повтором временных ошибок и экспоненциальной задержкой"""
+    for attempt in range(tries):
+        last_attempt = attempt == tries - 1
+        try:
+            async with openrouter[url].request(
+                "POST",
+                url,
+                headers=OPENROUTER_HEADERS,
+                json=payload
+            ) as response:
+                raw = await response.read()
+                if response.status not in RETRY_STATUSES or last_attempt:
+                    return response.status, raw
+        except (ClientConnectorError, ServerDisconnectedError):
+            if last_attempt:
+                raise
+        await asyncio.sleep((2 ** attempt) * 0.5 + random.random() * 0.3)
+
+# Лимиты запросов в минуту на одного пользователя
+RATE_LIMITS = {"chat": 60, "image": 10}
+# Запись живёт 60 секунд после последнего запроса. Размер взят с запасом, как у seen_updates,
+# чтобы активное окно не вытеснялось; при большем потоке лимит работает приблизительно
+request_log: TTLCache = TTLCache(maxsize=100_000, ttl=60)
+
+async def wait_if_throttled(user_id: int, endpoint: str):
+    """Скользящее окно в 60 секунд: ждём, пока у пользователя не освободится слот"""
+    key = (user_id, endpoint)
+    window: Optional[Deque[float]] = request_log.get(key)
+    if window is None:
+        window = request_log[key] = deque()
+    limit = RATE_LIMITS[endpoint]
+    while True:
+        now = time.monotonic()
+        while window and now - window[0] >= 60:
+            window.popleft()
+        if len(window) < limit:
+            window.append(now)
+            request_log[key] = window
+            return
+        await asyncio.sleep(window[0] + 60 - now)
+
+# Тексты интерфейса
+BTN_GENERATE = "🖼 Сгенерировать изображение"
+BTN_RESET = "🔄 Сбросить контекст"
+WELCOME_TEXT = (
+    "✨ <b>AI Бот с функциями:</b>\n"
+    "- Генерация изображений через Stable Diffusion\n"
+    "- Умный чат на основе Llama 4 Mavericks\n\n"
+    "Используйте кнопки ниже:"
+)
+
+# Клавиатура статична, поэтому собирается один раз при импорте
+MAIN_KB: ReplyKeyboardMarkup = ReplyKeyboardBuilder().row(
+    KeyboardButton(text=BTN_GENERATE),
+    KeyboardButton(text=BTN_RESET)
+).as_markup(resize_keyboard=True)
+
+async def generate_image(prompt: str) -> Optional[str]:
+    """Генерация изображения через Stable Diffusion XL, возвращает URL картинки"""
     payload = {
         "model": "stabilityai/stable-diffusion-xl-base-1.0",
         "input": {
@@ -71,113 +267,153 @@ async def generate_image(prompt: str) -> Optional[bytes]:
     }
     
     try:
-        async with http_session.post(
-            "https://openrouter.ai/api/v1/images/generations",
-            headers=headers,
-            json=payload
-        ) as response:
-            if response.status != 200:
-                error_text = await response.text()
-                logger.error(f"Ошибка генерации: {response.status} - {error_text}")
-                return None
-                
-            data = await response.json()
-            
-            if "data" in data and data["data"]:
-                image_url = data["data"][0]["url"]
-                async with http_session.get(image_url) as img_response:
-                    if img_response.status == 200:
-                        return await img_response.read()
-                    logger.error(f"Ошибка загрузки изображения: {img_response.status}")
+        status, raw = await post_openrouter(OPENROUTER_IMAGES_URL, payload)
+        if status != 200:
+            error_text = raw[:500].decode("utf-8", "replace")
+            logger.error("Ошибка генерации: %s - %s", status, error_text)
             return None
+            
+        data = orjson.loads(raw)
+        if "data" in data and data["data"]:
+            return data["data"][0]["url"]
+        return None
     except Exception as e:
-        logger.error(f"Ошибка при генерации изображения: {str(e)}")
+        logger.error("Ошибка при генерации изображения: %s", e)
         return None
 
+# Примерный бюджет истории в токенах (~4 символа на токен)
+MAX_CONTEXT_TOKENS = 4000
+
+def prune_history(history: Deque[dict]):
+    """Удаляет самые старые сообщения, пока история не уложится в бюджет"""
+    tokens = sum(len(msg["content"]) // 4 for msg in history)
+    while len(history) > 1 and tokens > MAX_CONTEXT_TOKENS:
+        tokens -= len(history.popleft()["content"]) // 4
+
+async def request_reply(payload: dict) -> Tuple[str, bool]:
+    """Запрос ответа модели: возвращает текст для пользователя и признак успеха"""
+    try:
+        status, raw = await post_openrouter(OPENROUTER_CHAT_URL, payload)
+        if status != 200:
+            error_text = raw[:500].decode("utf-8", "replace")
+            logger.error("Ошибка API: %s - %s", status, error_text)
+            return f"❌ Ошибка API (код {status})", False
+        
+        data = orjson.loads(raw)
+        
+        # Обработка ответа
+        if "choices" in data and data["choices"]:
+            return data["choices"][0]["message"]["content"], True
+        
+        logger.error("Неожиданный формат ответа: %s", data)
+        return "⚠️ Получен неожиданный формат ответа", False
+            
+    except Exception as e:
+        logger.error("Ошибка запроса: %s", e)
+        return f"⚠️ Ошибка при обработке запроса: {e}", False
+
 async def ask_llama(prompt: str, user_id: int) -> str:
     """Запрос к Llama 4 Mavericks через OpenRouter"""
-    headers = {
-        "Authorization": f"Bearer {OPENROUTER_API_KEY}",
-        "Content-Type": "application/json",
-        "HTTP-Referer": SITE_URL,
-        "X-Title": SITE_NAME
-    }
-    
-    # Инициализация контекста
-    if user_id not in user_context:
-        user_context[user_id] = {"chat_history": []}
+    # Инициализация контекста: храним только последние 6 сообщений
+    context = user_context.get(user_id, {})
+    user_context[user_id] = context  # запись заново продлевает TTL
+    if "chat_history" not in context:
+        context["chat_history"] = deque(maxlen=6)
+    history = context["chat_history"]
     
     # Добавляем новый запрос в историю
-    user_context[user_id]["chat_history"].append({"role": "user", "content": prompt})
+    history.append({"role": "user", "content": prompt})
+    prune_history(history)
     
     payload = {
         "model": "meta-llama/llama-4-maverick:free",  # Используем Llama 4 Mavericks
-        "messages": user_context[user_id]["chat_history"][-6:],  # Последние 6 сообщений
+        "messages": SYSTEM_PROMPT + list(history),
         "temperature": 0.7
     }
     
-    try:
-        async with http_session.post(
-            "https://openrouter.ai/api/v1/chat/completions",
-            headers=headers,
-            json=payload
-        ) as response:
-            if response.status != 200:
-                error_text = await response.text()
-                logger.error(f"Ошибка API: {response.status} - {error_text}")
-                return f"❌ Ошибка API (код {response.status})"
-            
-            data = await response.json()
-            
-            # Обработка ответа
-            if "choices" in data and data["choices"]:
-                reply = data["choices"][0]["message"]["content"]
-                user_context[user_id]["chat_history"].append({"role": "assistant", "content": reply})
-                return reply
-            
-            logger.error(f"Неожиданный формат ответа: {data}")
-            return "⚠️ Получен неожиданный формат ответа"
-            
-    except Exception as e:
-        logger.error(f"Ошибка запроса: {str(e)}")
-        return f"⚠️ Ошибка при обработке запроса: {str(e)}"
+    # Одинаковое первое сообщение (например, "Привет") отвечаем из кэша
+    opening = len(history) == 1
+    cache_key = hashlib.sha256(orjson.dumps(payload["messages"])).hexdigest()
+    reply = reply_cache.get(cache_key) if opening else None
+    if reply is None:
+        # Лимит проверяется до общего запроса, чтобы чужой лимит не задерживал остальных
+        await wait_if_throttled(user_id, "chat")
+        pending = reply_inflight.get(cache_key)
+        if pending is not None:
+            # Такой же запрос уже выполняется — берём его результат, в том числе ошибку
+            reply, ok = await asyncio.shield(pending)
+        else:
+            future = asyncio.get_running_loop().create_future()
+            reply_inflight[cache_key] = future
+            result = ("⚠️ Запрос был прерван", False)
+            try:
+                result = await request_reply(payload)
+            finally:
+                del reply_inflight[cache_key]
+                future.set_result(result)
+            reply, ok = result
+            if ok and opening:
+                reply_cache[cache_key] = reply
+        if not ok:
+            return reply
+    
+    history.append({"role": "assistant", "content": reply})
+    return reply
+
+@dp.update.outer_middleware()
+async def track_activity(handler, event: types.Update, data: dict):
+    """Отмечает время последнего апдейта для keep_alive"""
+    global last_activity
+    last_activity = time.monotonic()
+    return await handler(event, data)
+
+@dp.update.outer_middleware()
+async def drop_duplicate_updates(handler, event: types.Update, data: dict):
+    """Пропускает повторно доставленные апдейты до запуска обработчиков"""
+    if event.update_id in seen_updates:
+        logger.info("Повторный апдейт %s пропущен", event.update_id)
+        return None
+    seen_updates[event.update_id] = True
+    return await handler(event, data)
 
 @dp.message(Command("start", "help"))
 async def cmd_start(message: Message):
-    await message.answer(
-        "✨ <b>AI Бот с функциями:</b>\n"
-        "- Генерация изображений через Stable Diffusion\n"
-        "- Умный чат на основе Llama 4 Mavericks\n\n"
-        "Используйте кнопки ниже:",
-        reply_markup=get_main_kb()
-    )
+    await message.answer(WELCOME_TEXT, reply_markup=MAIN_KB)
 
-@dp.message(F.text == "🔄 Сбросить контекст")
 async def reset_context(message: Message):
     user_context.pop(message.from_user.id, None)
-    await message.answer("Контекст очищен!", reply_markup=get_main_kb())
+    await message.answer("Контекст очищен!", reply_markup=MAIN_KB)
 
-@dp.message(F.text == "🖼 Сгенерировать изображение")
 async def ask_gen_prompt(message: Message):
     user_id = message.from_user.id
-    if user_id not in user_context:
-        user_context[user_id] = {}
-    user_context[user_id]["awaiting_image_prompt"] = True
+    context = user_context.get(user_id, {})
+    context["awaiting_image_prompt"] = True
+    user_context[user_id] = context
     await message.answer("Введите описание изображения:")
 
+# Кнопки клавиатуры: текст кнопки -> обработчик
+BUTTONS = {
+    BTN_GENERATE: ask_gen_prompt,
+    BTN_RESET: reset_context
+}
+
 @dp.message(F.text)
 async def handle_text(message: Message):
+    button_handler = BUTTONS.get(message.text)
+    if button_handler:
+        await button_handler(message)
+        return
+    
     user_id = message.from_user.id
     text = message.text.strip()
     
     if text.lower() == "отмена":
         user_context.pop(user_id, None)
-        await message.answer("Операция отменена", reply_markup=get_main_kb())
+        await message.answer("Операция отменена", reply_markup=MAIN_KB)
         return
     
-    if user_id in user_context and user_context[user_id].get("awaiting_image_prompt"):
-        user_context[user_id].pop("awaiting_image_prompt")
-        
+    context = user_context.get(user_id)
+    if context and context.pop("awaiting_image_prompt", None):
         if len(text) > 500:
             await message.answer("❌ Слишком длинное описание. Максимум 500 символов.")
             return
@@ -185,41 +421,99 @@ async def handle_text(message: Message):
         await process_image_generation(message, text)
         return
     
-    if text not in ["🖼 Сгенерировать изображение", "🔄 Сбросить контекст"]:
-        reply = await ask_llama(text, user_id)
-        await message.answer(reply, reply_markup=get_main_kb())
+    buffer_key = (message.chat.id, user_id)
+    buffered = pending_messages.get(buffer_key)
+    if buffered is not None:
+        buffered.append(text)
+        return
+    pending_messages[buffer_key] = buffered = [text]
+    try:
+        await asyncio.sleep(CHAT_DEBOUNCE)
+    finally:
+        del pending_messages[buffer_key]
+    
+    async with ChatActionSender.typing(bot=bot, chat_id=message.chat.id):
+        reply = await ask_llama("\n".join(buffered), user_id)
+    await message.answer(reply, reply_markup=MAIN_KB)
 
 async def process_image_generation(message: Message, prompt: str):
-    await bot.send_chat_action(message.chat.id, "upload_photo")
-    image_data = await generate_image(prompt)
+    key = hashlib.sha256(prompt.encode()).hexdigest()
     
-    if image_data:
-        await message.answer_photo(
-            BufferedInputFile(image_data, "generated_image.png"),
-            caption=f"🎨 {prompt}"
-        )
-    else:
+    # Статус "отправляет фото" повторяется, пока идёт генерация и загрузка
+    async with ChatActionSender.upload_photo(bot=bot, chat_id=message.chat.id):
+        file_id = image_cache.get(key)
+        if file_id is None:
+            # Лимит проверяем до регистрации запроса, чтобы ожидание не держало других
+            await wait_if_throttled(message.from_user.id, "image")
+            file_id = image_cache.get(key)
+        
+        pending = image_inflight.get(key) if file_id is None else None
+        if pending is not None:
+            # Такой же промпт уже генерируется — берём его результат, в том числе неудачу
+            file_id = await asyncio.shield(pending)
+            if file_id:
+                await message.answer_photo(file_id, caption=f"🎨 {prompt}")
+        elif file_id:
+            await message.answer_photo(file_id, caption=f"🎨 {prompt}")
+        else:
+            future = asyncio.get_running_loop().create_future()
+            image_inflight[key] = future
+            try:
+                image_url = await generate_image(prompt)
+                
+                if image_url:
+                    # Картинка передаётся в Telegram потоком, без буферизации в памяти
+                    try:
+                        sent = await message.answer_photo(
+                            URLInputFile(image_url, filename="generated_image.png"),
+                            caption=f"🎨 {prompt}"
+                        )
+                        file_id = sent.photo[-1].file_id
+                        image_cache[key] = file_id
+                    except Exception as e:
+                        logger.error("Ошибка загрузки изображения: %s", e)
+            finally:
+                del image_inflight[key]
+                future.set_result(file_id)
+    
+    if not file_id:
         await message.answer("❌ Не удалось сгенерировать изображение. Попробуйте другой запрос.")
 
 async def keep_alive():
-    """Периодические запросы для поддержания активности"""
+    """Пинг /healthz, только если бот простаивал дольше KEEP_ALIVE_INTERVAL"""
     while True:
+        await asyncio.sleep(KEEP_ALIVE_INTERVAL)
+        if time.monotonic() - last_activity < KEEP_ALIVE_INTERVAL:
+            continue
         try:
             async with http_session.get(f"{BASE_URL}/healthz") as resp:
-                logger.info(f"Keep-alive: {resp.status}")
+                logger.debug("Keep-alive: %s", resp.status)
         except Exception as e:
-            logger.error(f"Keep-alive failed: {str(e)}")
-        await asyncio.sleep(300)  # Каждые 5 минут
+            logger.error("Keep-alive failed: %s", e)
 
 async def health_check(request):
     return web.Response(text="OK")
 
 async def on_startup(app: web.Application):
     global http_session
-    http_session = ClientSession()
+    # Общий пул соединений: переиспользуем TLS-сессии и кэшируем DNS
+    connector = TCPConnector(
+        limit=200,
+        limit_per_host=64,
+        ttl_dns_cache=300,
+        keepalive_timeout=75,
+        enable_cleanup_closed=True
+    )
+    http_session = ClientSession(
+        connector=connector,
+        timeout=ClientTimeout(total=60, connect=10),
+        cookie_jar=DummyCookieJar(),
+        json_serialize=dumps_json
+    )
     
     await bot.set_webhook(
         url=f"{BASE_URL}/webhook",
+        allowed_updates=dp.resolve_used_update_types(),
         drop_pending_updates=True
     )
     asyncio.create_task(keep_alive())
@@ -236,9 +530,11 @@ if __name__ == "__main__":
     app = web.Application()
     app.router.add_get("/healthz", health_check)
     
+    # Telegram сразу получает 200 OK, апдейт обрабатывается в фоновой задаче
     webhook_handler = SimpleRequestHandler(
         dispatcher=dp,
         bot=bot,
+        handle_in_background=True
     )
     webhook_handler.register(app, path="/webhook")
     setup_application(app, dp, bot=bot)
@@ -246,6 +542,13 @@ if __name__ == "__main__":
     app.on_startup.append(on_startup)
     app.on_shutdown.append(on_shutdown)
     
+    # uvloop быстрее стандартного цикла событий на сетевом I/O
+    try:
+        import uvloop
+        asyncio.set_event_loop_policy(uvloop.EventLoopPolicy())
+    except ImportError:
+        logger.info("uvloop не установлен, используется стандартный цикл asyncio")
+    
     try:
         web.run_app(
             app,
@@ -254,5 +557,5 @@ if __name__ == "__main__":
             access_log=logger
         )
     except Exception as e:
-        logger.error(f"Server error: {str(e)}")
+        logger.error("Server error: %s", e)
         raise
\ No newline at end of file